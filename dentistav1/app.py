@@ -4,6 +4,9 @@ import sqlite3
 from flask import Flask, request, redirect, url_for, send_from_directory, render_template, jsonify, session, g
 from werkzeug.utils import secure_filename
 from py import process_uploaded_files, parse_gpt_output, save_to_excel
+from model_router import model_stats, load_config
+from scheduler import get_scheduler
+from form_layouts import load_layouts
 from functools import wraps
 
 UPLOAD_FOLDER = 'uploads'
@@ -16,6 +19,7 @@ app.config['PROCESSED_FOLDER'] = PROCESSED_FOLDER
 app.secret_key = 'Thiago666'  # Secret key for session management
 DATABASE = 'database.db'
 ACCESS_PASSWORD = 'Thiago666'  # The password to access the site
+ADMIN_USERS = {u.strip() for u in os.getenv('ADMIN_USERS', '').split(',') if u.strip()}  # Usernames allowed on admin pages
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
@@ -73,6 +77,15 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Admin decorator, for pages with data across all users; use below login_required
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if session.get('username') not in ADMIN_USERS:
+            return jsonify({'error': 'Admin access required.'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
 @app.route('/')
 def index():
     if 'access_granted' in session and session['access_granted']:
@@ -82,7 +95,8 @@ def index():
 @app.route('/home')
 @login_required
 def home():
-    return render_template('home.html')
+    # The model choices are the router's tiers, so the selection is honoured.
+    return render_template('home.html', layouts=sorted(load_layouts()), models=load_config()['tiers'])
 
 @app.route('/password', methods=['GET', 'POST'])
 def password():
@@ -118,6 +132,84 @@ def logout():
     session.clear()
     return redirect(url_for('login'))
 
+@app.route('/upload', methods=['GET', 'POST'])
+@login_required
+def upload_file():
+    layouts = sorted(load_layouts())
+    if request.method == 'POST':
+        output_format = request.form.get('format')
+
+        if not output_format:
+            return render_template('upload.html', layouts=layouts, error="Please select an output format.")
+
+        file_extension = output_format.lower()
+        # Checked before any image is processed (and paid for); save_to_excel
+        # can write these three
+        if file_extension not in ['xlsx', 'csv', 'json']:
+            return render_template('upload.html', layouts=layouts, error="Invalid output format selected.")
+
+        if 'file' not in request.files or not request.files.getlist('file'):
+            return render_template('upload.html', layouts=layouts, error="Please select at least one file.")
+
+        # A clinic form template lets known forms skip the GPT call
+        layout = request.form.get('layout') or None
+        if layout and layout not in layouts:
+            return render_template('upload.html', layouts=layouts, error="Unknown form template selected.")
+
+        files = request.files.getlist('file')
+        session_id = os.urandom(16).hex()
+        session_upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], session_id)
+        os.makedirs(session_upload_dir)
+
+        for file in files:
+            if file and allowed_file(file.filename):
+                filename = secure_filename(file.filename)
+                file_path = os.path.join(session_upload_dir, filename)
+                file.save(file_path)
+
+        # The requested model is where routing starts; it still escalates on failure
+        model = request.form.get('model') or None
+        output_file = os.path.join(app.config['PROCESSED_FOLDER'], f'{session_id}.{file_extension}')
+        processed_file_path = process_uploaded_files(session_upload_dir, None, output_file, layout=layout, model=model, user_id=session['user_id'])
+
+        if processed_file_path and os.path.exists(processed_file_path):
+            db = get_db()
+            db.execute('INSERT INTO files (user_id, filename) VALUES (?, ?)', (session['user_id'], os.path.basename(processed_file_path)))
+            db.commit()
+            return jsonify({
+                'download_url': url_for('download_file', filename=os.path.basename(processed_file_path)),
+                'filename': os.path.basename(processed_file_path)
+            })
+        else:
+            return jsonify({'error': "Failed to save the file."})
+
+    return render_template('upload.html', layouts=layouts)
+
+@app.route('/processed/<filename>')
+@login_required
+def download_file(filename):
+    path = os.path.join(app.config['PROCESSED_FOLDER'], filename)
+    if os.path.exists(path):
+        return send_from_directory(app.config['PROCESSED_FOLDER'], filename)
+    else:
+        return "File not found.", 404
+
+# Per-model latency, cost and success rates recorded by the router
+@app.route('/model_stats', methods=['GET'])
+@login_required
+@admin_required
+def model_stats_view():
+    return jsonify(model_stats())
+
+# Per-user queue depth and wait times of the fair-share scheduler; admins see
+# every user, everyone else only their own uploads
+@app.route('/metrics', methods=['GET'])
+@login_required
+def metrics():
+    if session.get('username') in ADMIN_USERS:
+        return jsonify(get_scheduler().metrics())
+    return jsonify(get_scheduler().metrics(session['user_id']))
+
 @app.route('/history', methods=['GET'])
 @login_required
 def history():
@@ -0,0 +1,119 @@
+import os
+import re
+import unicodedata
+
+# Field-level confidence for rows parsed from GPT output. A field is as
+# trustworthy as the OCR words it was copied from: each value is matched back
+# against the words Vision returned and scored with their confidences. Values
+# that cannot be found in the OCR at all score 0, which is what we want for
+# anything GPT made up.
+
+CONFIDENCE_THRESHOLD = float(os.getenv('CONFIDENCE_THRESHOLD', '0.8'))
+
+NUMERIC_FIELDS = ('Phone', 'CPF', 'Date of Birth')
+TEXT_FIELDS = ('Name', 'Email', 'Address')
+REQUIRED_FIELDS = ('Name', 'Phone')
+
+TOKEN_RE = re.compile(r'\w+')
+NUMBER_RE = re.compile(r'\d+')
+
+def _fold(text):
+    # GPT often restores accents the scan lost (JOAO -> João), so tokens are
+    # compared without them, like form_layouts._normalize does.
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+def _same_year(a, b):
+    # 90 on the form and 1990 from GPT (or the other way round) are one year.
+    return a == b or (a < 100 and a == b % 100) or (b < 100 and b == a % 100)
+
+class OcrIndex:
+    # Built once per form so that scoring each field is a dict lookup (text)
+    # or a substring search over the digits of the page (numbers), instead of a
+    # scan over every word. Dates are matched on the numbers of the page in
+    # order, since GPT pads and reformats them (1/2/90 -> 01/02/1990).
+    def __init__(self, words):
+        self.tokens = {}
+        digits = []
+        self.digit_confidences = []
+        self.numbers = []
+        for word in words:
+            for token in TOKEN_RE.findall(_fold(word['text'])):
+                self.tokens[token] = max(self.tokens.get(token, 0.0), word['confidence'])
+            for number in NUMBER_RE.findall(word['text']):
+                self.numbers.append((int(number), word['confidence']))
+            for char in word['text']:
+                if char.isdigit():
+                    digits.append(char)
+                    self.digit_confidences.append(word['confidence'])
+        self.digits = ''.join(digits)
+
+    def text_confidence(self, value):
+        tokens = TOKEN_RE.findall(_fold(value))
+        if not tokens:
+            return None
+        return sum(self.tokens.get(token, 0.0) for token in tokens) / len(tokens)
+
+    def numeric_confidence(self, value, phone=False):
+        digits = ''.join(c for c in value if c.isdigit())
+        if not digits:
+            return None
+        if phone:
+            # GPT may add the +55 country code or a leading trunk 0 the form
+            # never had; match on the national number, as normalize_phone does.
+            if digits.startswith('55') and len(digits) in (12, 13):
+                digits = digits[2:]
+            digits = digits.lstrip('0') or digits
+        start = self.digits.find(digits)
+        if start < 0:
+            return 0.0
+        span = self.digit_confidences[start:start + len(digits)]
+        return sum(span) / len(span)
+
+    def date_confidence(self, value):
+        parts = [int(p) for p in NUMBER_RE.findall(value)]
+        if len(parts) != 3:
+            return self.numeric_confidence(value)
+        if parts[0] > 31:
+            # ISO order, year first.
+            parts.reverse()
+        day, month, year = parts
+        for i in range(len(self.numbers) - 2):
+            (d, d_conf), (m, m_conf), (y, y_conf) = self.numbers[i:i + 3]
+            if d == day and m == month and _same_year(y, year):
+                return (d_conf + m_conf + y_conf) / 3
+        # Dates written without separators (01021990) are one number on the
+        # page and still match as digits.
+        return self.numeric_confidence(value)
+
+def field_confidences(row, index):
+    scores = {}
+    for field in NUMERIC_FIELDS + TEXT_FIELDS:
+        value = row.get(field, '')
+        if not value:
+            continue
+        if field == 'Date of Birth':
+            score = index.date_confidence(value)
+        elif field in NUMERIC_FIELDS:
+            score = index.numeric_confidence(value, phone=field == 'Phone')
+        else:
+            score = index.text_confidence(value)
+        if score is not None:
+            scores[field] = score
+    return scores
+
+def score_rows(rows, ocr, threshold=CONFIDENCE_THRESHOLD):
+    # Annotates rows in place with 'Confidence' (the weakest field of the row)
+    # and 'Low Confidence Fields', and returns the confidence of the form as a
+    # whole. Missing required fields count as zero.
+    index = OcrIndex(ocr['words'])
+    form_confidence = 1.0 if rows else 0.0
+    for row in rows:
+        scores = field_confidences(row, index)
+        for field in REQUIRED_FIELDS:
+            scores.setdefault(field, 0.0)
+        row_confidence = min(scores.values())
+        row['Confidence'] = round(row_confidence, 3)
+        row['Low Confidence Fields'] = ', '.join(f for f, s in scores.items() if s < threshold)
+        form_confidence = min(form_confidence, row_confidence)
+    return form_confidence
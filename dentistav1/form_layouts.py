@@ -0,0 +1,146 @@
+import os
+import re
+import json
+import unicodedata
+from confidence import CONFIDENCE_THRESHOLD
+
+# Template-based field extraction for forms with a known layout. Each clinic's
+# form is described in FORM_LAYOUTS_FILE by the label printed before every field
+# and the region of the page (as fractions of width/height) where it sits:
+#
+#   "clinica-centro": {
+#       "fields": {
+#           "Name":  {"label": "NOME", "region": [0.0, 0.0, 0.6, 0.3]},
+#           "Phone": {"label": "TELEFONE", "region": [0.5, 0.0, 1.0, 0.3]}
+#       }
+#   }
+#
+# The value of a field is the text that follows its label on the same line,
+# inside the region. This only needs the word boxes Vision already returned,
+# so known forms are read locally without an LLM call.
+
+FORM_LAYOUTS_FILE = os.getenv('FORM_LAYOUTS_FILE', os.path.join(os.path.dirname(__file__), 'form_layouts.json'))
+
+FIELDS = ('Name', 'Phone', 'Email', 'CPF', 'Date of Birth', 'Address')
+REQUIRED_FIELDS = ('Name', 'Phone')
+
+PHONE_RE = re.compile(r'(?:\(?\d{2}\)?[\s.-]*)?\d{4,5}[\s.-]?\d{4}')
+
+_layouts = None
+
+def load_layouts(path=None):
+    global _layouts
+    if path is None and _layouts is not None:
+        return _layouts
+    path = path or FORM_LAYOUTS_FILE
+    if not os.path.exists(path):
+        layouts = {}
+    else:
+        with open(path, encoding='utf-8') as f:
+            layouts = json.load(f)
+    if path == FORM_LAYOUTS_FILE:
+        _layouts = layouts
+    return layouts
+
+def get_layout(name):
+    layout = load_layouts().get(name)
+    if layout is None:
+        print(f"[WARNING] Unknown form layout '{name}'")
+    return layout
+
+def _normalize(text):
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(c for c in text if c.isalnum())
+
+def _group_lines(words, width, height):
+    # Groups words into text lines by the vertical centre of their boxes and
+    # converts boxes to page fractions.
+    placed = []
+    for word in words:
+        x0, y0, x1, y1 = word['box']
+        placed.append({
+            'text': word['text'],
+            'key': _normalize(word['text']),
+            'confidence': word['confidence'],
+            'x0': x0 / width, 'x1': x1 / width,
+            'yc': (y0 + y1) / 2 / height, 'h': max(y1 - y0, 1) / height
+        })
+    placed.sort(key=lambda w: w['yc'])
+    lines = []
+    for word in placed:
+        if lines and abs(word['yc'] - lines[-1][-1]['yc']) < word['h'] / 2:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+    for line in lines:
+        line.sort(key=lambda w: w['x0'])
+    return lines
+
+def _find_label(lines, label_key, region):
+    # Matches the label against the concatenation of consecutive words, since
+    # Vision splits labels like "E-MAIL" or "TELEFONE:" into several words.
+    x0, y0, x1, y1 = region
+    for line in lines:
+        for i, first in enumerate(line):
+            if not (x0 <= first['x0'] <= x1 and y0 <= first['yc'] <= y1):
+                continue
+            if not first['key'] or not label_key.startswith(first['key']):
+                continue
+            joined = ''
+            for j in range(i, len(line)):
+                joined += line[j]['key']
+                if joined == label_key:
+                    return line, j + 1
+                if not label_key.startswith(joined):
+                    break
+    return None, None
+
+def _read_field(lines, spec, label_starts):
+    region = spec.get('region', [0.0, 0.0, 1.0, 1.0])
+    line, start = _find_label(lines, _normalize(spec['label']), region)
+    if line is None:
+        return '', 0.0
+    value = []
+    for word in line[start:]:
+        # Stop at the region edge or where the next field's label begins.
+        if word['x0'] > region[2] or word['key'] in label_starts:
+            break
+        if word['key']:
+            value.append(word)
+    if not value:
+        return '', 0.0
+    text = ' '.join(w['text'] for w in value).strip(' :')
+    confidence = sum(w['confidence'] for w in value) / len(value)
+    return text, confidence
+
+def extract_with_layout(ocr, layout):
+    # Returns (rows, confidence) in the same shape process_image produces, with
+    # one row per phone number. Returns no rows when a required field could not
+    # be located, so the caller can fall back to GPT.
+    if not ocr['words'] or not ocr['width'] or not ocr['height']:
+        return [], 0.0
+    fields = layout['fields']
+    lines = _group_lines(ocr['words'], ocr['width'], ocr['height'])
+    label_starts = {_normalize(spec['label'].split()[0]) for spec in fields.values()}
+
+    values = {}
+    scores = {}
+    for field in FIELDS:
+        spec = fields.get(field)
+        if spec is None:
+            values[field] = ''
+            continue
+        values[field], score = _read_field(lines, spec, label_starts)
+        if values[field]:
+            scores[field] = score
+    if any(not values.get(field) for field in REQUIRED_FIELDS):
+        return [], 0.0
+
+    phones = [p.strip() for p in PHONE_RE.findall(values['Phone'])] or [values['Phone']]
+    rows = [dict(values, Phone=phone) for phone in phones]
+    confidence = min(scores.values())
+    low_fields = ', '.join(f for f, score in scores.items() if score < CONFIDENCE_THRESHOLD)
+    for row in rows:
+        row['Confidence'] = round(confidence, 3)
+        row['Low Confidence Fields'] = low_fields
+    return rows, confidence
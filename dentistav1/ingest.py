@@ -0,0 +1,183 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
+from tqdm import tqdm
+from form_layouts import load_layouts
+
+# Bulk ingestion of scanned archives from the command line:
+#
+#   python ingest.py /archive/2019 -o 2019.jsonl --workers 8
+#   python ingest.py manifest.txt -o 2019.csv --resume
+#
+# Images are streamed from the directory tree (or manifest) and at most
+# `workers * 2` of them are in flight at any time, so memory stays flat no
+# matter how large the archive is. Every finished image is appended to
+# `<output>.done`; --resume skips the paths listed there.
+
+IMAGE_EXTENSIONS = (".jpg", ".png", ".jpeg", ".tiff")
+CSV_FIELDS = [
+    'Source', 'Name', 'Phone', 'Email', 'CPF', 'Date of Birth', 'Address',
+    'Confidence', 'Low Confidence Fields', 'Needs Review'
+]
+
+def iter_directory(directory):
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for f in sorted(files):
+            if f.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, f)
+
+def iter_manifest(manifest_path):
+    # A manifest is either a plain list of paths, one per line, or a CSV file
+    # with a 'path' column. Relative paths are resolved against the manifest.
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, newline='', encoding='utf-8') as f:
+        if manifest_path.lower().endswith('.csv'):
+            paths = (row['path'] for row in csv.DictReader(f))
+        else:
+            paths = (line.strip() for line in f)
+        for path in paths:
+            if path and not path.startswith('#'):
+                yield os.path.join(base_dir, path)
+
+def load_done(done_path):
+    if not os.path.exists(done_path):
+        return set()
+    with open(done_path, encoding='utf-8') as f:
+        return {line.rstrip('\n') for line in f if line.strip()}
+
+class RowWriter:
+    def __init__(self, output_file, append):
+        self.format = 'csv' if output_file.lower().endswith('.csv') else 'jsonl'
+        write_header = not (append and os.path.exists(output_file) and os.path.getsize(output_file) > 0)
+        self.file = open(output_file, 'a' if append else 'w', newline='', encoding='utf-8')
+        if self.format == 'csv':
+            self.writer = csv.DictWriter(self.file, fieldnames=CSV_FIELDS, extrasaction='ignore')
+            if write_header:
+                self.writer.writeheader()
+
+    def write(self, source, rows):
+        for row in rows:
+            row = dict(row, Source=source)
+            if self.format == 'csv':
+                self.writer.writerow(row)
+            else:
+                self.file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def ingest(sources, output_file, workers=4, resume=False, layout=None):
+    from py import process_image, PipelineError
+
+    done_path = output_file + '.done'
+    done = load_done(done_path) if resume else set()
+    writer = RowWriter(output_file, append=resume)
+    done_log = open(done_path, 'a' if resume else 'w', encoding='utf-8')
+
+    stats = {'processed': 0, 'skipped': 0, 'failed': 0, 'empty': 0, 'rows': 0}
+    started = time.monotonic()
+    max_in_flight = workers * 2
+
+    def drain(pending, return_when):
+        finished, pending = wait(pending, return_when=return_when)
+        for future in finished:
+            source = pending_sources.pop(future)
+            progress.update(1)
+            # Failed images (provider outage, rate limit, unreadable file) are
+            # left out of .done so that --resume retries them. [] is a form
+            # that really had no data and is done.
+            try:
+                rows = future.result()
+            except PipelineError as e:
+                print(f"[ERROR] Provider error on '{source}': {e}")
+                stats['failed'] += 1
+                continue
+            except Exception as e:
+                print(f"[ERROR] Failed to process '{source}': {e}")
+                stats['failed'] += 1
+                continue
+            writer.write(source, rows)
+            # Only mark the image as done once its rows are on disk.
+            done_log.write(source + '\n')
+            done_log.flush()
+            stats['processed'] += 1
+            stats['rows'] += len(rows)
+            if not rows:
+                stats['empty'] += 1
+        return pending
+
+    pending = set()
+    pending_sources = {}
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor, tqdm(desc="Processing images", unit="img") as progress:
+            for source in sources:
+                source = os.path.abspath(source)
+                if source in done:
+                    stats['skipped'] += 1
+                    continue
+                if len(pending) >= max_in_flight:
+                    pending = drain(pending, FIRST_COMPLETED)
+                future = executor.submit(process_image, source, layout)
+                pending.add(future)
+                pending_sources[future] = source
+            if pending:
+                drain(pending, ALL_COMPLETED)
+    finally:
+        writer.close()
+        done_log.close()
+
+    elapsed = time.monotonic() - started
+    stats['elapsed_seconds'] = round(elapsed, 2)
+    stats['images_per_second'] = round(stats['processed'] / elapsed, 2) if elapsed > 0 else 0.0
+    return stats
+
+def print_summary(stats):
+    print("[INFO] Ingestion summary:")
+    print(f"  processed images : {stats['processed']}")
+    print(f"  without data     : {stats['empty']}")
+    print(f"  failed           : {stats['failed']}")
+    print(f"  skipped (resume) : {stats['skipped']}")
+    print(f"  rows written     : {stats['rows']}")
+    print(f"  elapsed          : {stats['elapsed_seconds']}s")
+    print(f"  throughput       : {stats['images_per_second']} images/s")
+    if stats['failed']:
+        print(f"[INFO] Run again with --resume to retry the {stats['failed']} failed images.")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill archives of dental forms through the digitization pipeline.")
+    parser.add_argument('source', help="Directory of images, or a manifest (.txt with one path per line, or .csv with a 'path' column).")
+    parser.add_argument('-o', '--output', required=True, help="Output file, .jsonl or .csv.")
+    parser.add_argument('-w', '--workers', type=int, default=4, help="Number of images processed concurrently.")
+    parser.add_argument('--resume', action='store_true', help="Skip images already recorded in <output>.done and append to the output.")
+    parser.add_argument('--layout', help="Form layout from form_layouts.json; known forms skip the GPT call.")
+    parser.add_argument('--summary', help="Also write the throughput summary as JSON to this file.")
+    args = parser.parse_args(argv)
+
+    if not args.output.lower().endswith(('.jsonl', '.csv')):
+        sys.exit("Error: output file must end in .jsonl or .csv.")
+    if args.workers < 1:
+        sys.exit("Error: --workers must be at least 1.")
+    if args.layout and args.layout not in load_layouts():
+        sys.exit(f"Error: unknown form layout '{args.layout}'. Known layouts: {', '.join(sorted(load_layouts())) or 'none'}.")
+
+    if os.path.isdir(args.source):
+        sources = iter_directory(args.source)
+    elif os.path.isfile(args.source):
+        sources = iter_manifest(args.source)
+    else:
+        sys.exit(f"Error: '{args.source}' is neither a directory nor a manifest file.")
+
+    stats = ingest(sources, args.output, workers=args.workers, resume=args.resume, layout=args.layout)
+    print_summary(stats)
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            json.dump(stats, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import os
+import json
+import random
+import sqlite3
+import threading
+
+# Picks which GPT models to try for a form, cheapest first. The tiers, prices
+# and thresholds come from MODEL_ROUTING_FILE (edited by the admin) and every
+# call is recorded in MODEL_STATS_DATABASE, bucketed by how long and how clean
+# the OCR text was. A tier whose recorded success rate in a bucket falls below
+# min_success_rate is skipped for forms in that bucket, so traffic moves to the
+# model that actually handles those forms instead of failing there first.
+
+MODEL_ROUTING_FILE = os.getenv('MODEL_ROUTING_FILE', os.path.join(os.path.dirname(__file__), 'model_routing.json'))
+MODEL_STATS_DATABASE = os.getenv('MODEL_STATS_DATABASE', 'database.db')
+
+DEFAULT_CONFIG = {
+    'tiers': ['gpt-4o-mini', 'gpt-4o'],
+    # USD per 1k tokens, [prompt, completion]
+    'prices': {'gpt-4o-mini': [0.00015, 0.0006], 'gpt-4o': [0.0025, 0.01]},
+    'long_text_chars': 1500,
+    'low_confidence': 0.8,
+    'min_success_rate': 0.5,
+    'min_samples': 20,
+    'explore_rate': 0.05
+}
+
+_config = None
+_local = threading.local()
+
+def load_config(path=None):
+    global _config
+    if path is None and _config is not None:
+        return _config
+    config = dict(DEFAULT_CONFIG)
+    path = path or MODEL_ROUTING_FILE
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            config.update(json.load(f))
+    if path == MODEL_ROUTING_FILE:
+        _config = config
+    return config
+
+def _get_db():
+    # One connection per thread; the pipeline runs in thread pools.
+    db = getattr(_local, 'db', None)
+    if db is None:
+        db = _local.db = sqlite3.connect(MODEL_STATS_DATABASE, timeout=30)
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS model_stats (
+                model TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                calls INTEGER NOT NULL DEFAULT 0,
+                successes INTEGER NOT NULL DEFAULT 0,
+                total_latency REAL NOT NULL DEFAULT 0,
+                total_cost REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (model, bucket)
+            )
+        ''')
+        db.commit()
+    return db
+
+def bucket_for(text, ocr_confidence):
+    config = load_config()
+    length = 'long' if len(text) > config['long_text_chars'] else 'short'
+    quality = 'low' if ocr_confidence < config['low_confidence'] else 'high'
+    return f"{length}-{quality}"
+
+def estimate_cost(model, usage):
+    prompt_price, completion_price = load_config()['prices'].get(model, [0.0, 0.0])
+    return (usage.get('prompt_tokens', 0) * prompt_price + usage.get('completion_tokens', 0) * completion_price) / 1000
+
+def choose_models(text, ocr_confidence, requested_model=None):
+    # Returns the models to try in order. A model requested by the user moves
+    # the starting point up to that tier but never skips the escalation path.
+    config = load_config()
+    tiers = list(config['tiers'])
+    if requested_model in tiers:
+        tiers = tiers[tiers.index(requested_model):]
+    elif requested_model:
+        print(f"[WARNING] Model '{requested_model}' is not in the routing tiers, ignoring it")
+
+    bucket = bucket_for(text, ocr_confidence)
+    stats = {
+        model: (calls, successes)
+        for model, calls, successes in _get_db().execute(
+            'SELECT model, calls, successes FROM model_stats WHERE bucket = ?', (bucket,)
+        )
+    }
+    chosen = []
+    for model in tiers[:-1]:
+        calls, successes = stats.get(model, (0, 0))
+        # Skipped tiers still get a small share of traffic so their success rate
+        # can recover after a model or prompt change.
+        if (calls >= config['min_samples'] and successes / calls < config['min_success_rate']
+                and random.random() >= config['explore_rate']):
+            continue
+        chosen.append(model)
+    # The last tier is always kept as the final fallback.
+    chosen.append(tiers[-1])
+    return chosen, bucket
+
+def record_call(model, bucket, latency, cost, success):
+    db = _get_db()
+    db.execute('''
+        INSERT INTO model_stats (model, bucket, calls, successes, total_latency, total_cost)
+        VALUES (?, ?, 1, ?, ?, ?)
+        ON CONFLICT (model, bucket) DO UPDATE SET
+            calls = calls + 1,
+            successes = successes + excluded.successes,
+            total_latency = total_latency + excluded.total_latency,
+            total_cost = total_cost + excluded.total_cost
+    ''', (model, bucket, int(success), latency, cost))
+    db.commit()
+
+def model_stats():
+    rows = _get_db().execute(
+        'SELECT model, bucket, calls, successes, total_latency, total_cost FROM model_stats ORDER BY model, bucket'
+    )
+    return [
+        {
+            'model': model,
+            'bucket': bucket,
+            'calls': calls,
+            'success_rate': round(successes / calls, 3) if calls else 0.0,
+            'avg_latency_seconds': round(total_latency / calls, 3) if calls else 0.0,
+            'avg_cost_usd': round(total_cost / calls, 6) if calls else 0.0,
+            'total_cost_usd': round(total_cost, 4)
+        }
+        for model, bucket, calls, successes, total_latency, total_cost in rows
+    ]
@@ -0,0 +1,157 @@
+import sys
+import argparse
+import pandas as pd
+
+# Batch clean-up of extracted rows before export. GPT emits one row per phone
+# number with every other field repeated, in whatever format it read off the
+# form. This normalizes CPF, phones, dates and casing with vectorized string
+# operations, collapses rows that describe the same patient and can pivot the
+# phones of a patient into Phone 1, Phone 2, ... columns. Everything here is a
+# single pass over each column, so large exports stay fast.
+
+NAME_PARTICLES = r'\b(Da|De|Do|Das|Dos)\b'
+
+def _digits(series):
+    return series.str.replace(r'\D', '', regex=True)
+
+def normalize_cpf(series):
+    digits = _digits(series)
+    formatted = digits.str.replace(r'^(\d{3})(\d{3})(\d{3})(\d{2})$', r'\1.\2.\3-\4', regex=True)
+    # Values that are not 11 digits are left as read so they can be reviewed.
+    return formatted.where(digits.str.len() == 11, series)
+
+def normalize_phone(series):
+    digits = _digits(series)
+    digits = digits.where(~(digits.str.startswith('55') & digits.str.len().isin([12, 13])), digits.str[2:])
+    digits = digits.str.lstrip('0')
+    formatted = digits.str.replace(r'^(\d{2})(\d{4,5})(\d{4})$', r'(\1) \2-\3', regex=True)
+    local = digits.str.replace(r'^(\d{4,5})(\d{4})$', r'\1-\2', regex=True)
+    length = digits.str.len()
+    return formatted.where(length.isin([10, 11]), local.where(length.isin([8, 9]), series))
+
+def normalize_date(series):
+    cleaned = series.str.replace(r'[.\-\s]+', '/', regex=True)
+    parsed = pd.to_datetime(cleaned, format='%d/%m/%Y', errors='coerce')
+    short = pd.to_datetime(cleaned, format='%d/%m/%y', errors='coerce')
+    # %y maps 00-68 to 20xx, but a date of birth is never in the future.
+    short = short.mask(short > pd.Timestamp.today(), short - pd.DateOffset(years=100))
+    parsed = parsed.fillna(short)
+    return parsed.dt.strftime('%d/%m/%Y').where(parsed.notna(), series)
+
+def normalize_name(series):
+    titled = series.str.replace(r'\s+', ' ', regex=True).str.title()
+    return titled.str.replace(NAME_PARTICLES, lambda m: m.group(0).lower(), regex=True)
+
+def normalize_email(series):
+    return series.str.lower()
+
+NORMALIZERS = {
+    'Name': normalize_name,
+    'Phone': normalize_phone,
+    'Email': normalize_email,
+    'CPF': normalize_cpf,
+    'Date of Birth': normalize_date,
+    'Address': normalize_name
+}
+
+def _on_uniques(series, func):
+    # The repeated-row layout means most values occur several times, so each
+    # normalizer only runs on the distinct values and is mapped back by code.
+    codes, uniques = pd.factorize(series)
+    normalized = func(pd.Series(uniques)).to_numpy()
+    return pd.Series(normalized[codes], index=series.index)
+
+def normalize_rows(df):
+    df = df.copy()
+    for column, func in NORMALIZERS.items():
+        if column in df:
+            df[column] = _on_uniques(df[column].fillna('').astype(str).str.strip(), func)
+    return df
+
+def patient_key(df):
+    # The CPF identifies a patient when present; otherwise fall back to the
+    # name and date of birth. A name alone is too common to merge on, so rows
+    # with neither a CPF nor both of those get a key of their own.
+    cpf = _digits(df['CPF']) if 'CPF' in df else pd.Series('', index=df.index)
+    name = df['Name'].str.casefold() if 'Name' in df else pd.Series('', index=df.index)
+    dob = df['Date of Birth'] if 'Date of Birth' in df else pd.Series('', index=df.index)
+    row = 'r:' + pd.Series(range(len(df)), index=df.index).astype(str)
+    by_name = ('n:' + name + '|' + dob).where(name.ne('') & dob.ne(''), row)
+    return cpf.where(cpf.str.len() == 11, by_name)
+
+def collapse_duplicates(df):
+    # Fills each patient's missing fields from the other rows of the same
+    # patient, then drops repeated (patient, phone) rows and phone-less rows of
+    # patients who do have a phone. The fill runs first so no value that only
+    # a dropped row had is lost. A patient is as confident as its weakest row
+    # and needs review if any row did.
+    df = df.assign(_key=patient_key(df))
+    if 'Confidence' in df:
+        df['Confidence'] = pd.to_numeric(df['Confidence'], errors='coerce')
+        df['Confidence'] = df.groupby('_key', sort=False)['Confidence'].transform('min')
+    if 'Needs Review' in df:
+        # CSV round-trips turn the flag into 'True'/'False' strings.
+        df['Needs Review'] = df['Needs Review'].astype(str).str.lower().eq('true')
+        df['Needs Review'] = df.groupby('_key', sort=False)['Needs Review'].transform('max')
+    skip = {'Phone', 'Confidence', 'Needs Review', 'Low Confidence Fields'}
+    filled = df.replace('', pd.NA).groupby('_key', sort=False).transform('first')
+    for column in filled.columns:
+        if column not in skip:
+            # Only empty cells are filled; a value the row already has is kept
+            # even if another row of the patient disagrees.
+            empty = df[column].isna() | df[column].eq('')
+            df[column] = df[column].mask(empty, filled[column].fillna(df[column]))
+    if 'Phone' in df:
+        has_phone = df['Phone'].ne('')
+        patient_has_phone = has_phone.groupby(df['_key'], sort=False).transform('any')
+        df = df[has_phone | ~patient_has_phone]
+    df = df.drop_duplicates(subset=['_key', 'Phone'] if 'Phone' in df else ['_key'])
+    return df.drop(columns='_key').reset_index(drop=True)
+
+def pivot_phones(df):
+    # One row per patient with Phone 1, Phone 2, ... columns.
+    if 'Phone' not in df or df.empty:
+        return df
+    df = df.assign(_key=patient_key(df))
+    df['_n'] = df.groupby('_key', sort=False).cumcount() + 1
+    phones = df.pivot(index='_key', columns='_n', values='Phone')
+    phones.columns = [f'Phone {n}' for n in phones.columns]
+    patients = df[df['_n'] == 1].drop(columns=['Phone', '_n']).set_index('_key')
+    result = patients.join(phones).reset_index(drop=True)
+    columns = list(result.columns)
+    phone_columns = list(phones.columns)
+    others = [c for c in columns if c not in phone_columns]
+    insert_at = others.index('Name') + 1 if 'Name' in others else 0
+    return result[others[:insert_at] + phone_columns + others[insert_at:]].fillna({c: '' for c in phone_columns})
+
+def postprocess(df, pivot=False):
+    if df.empty:
+        return df
+    df = collapse_duplicates(normalize_rows(df))
+    if pivot:
+        df = pivot_phones(df)
+    return df
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Normalize and deduplicate extracted rows (e.g. ingest.py output) before export.")
+    parser.add_argument('input_file', help=".jsonl or .csv produced by ingest.py")
+    parser.add_argument('output_file', help=".xlsx or .csv")
+    parser.add_argument('--pivot-phones', action='store_true', help="One row per patient with the phones in separate columns.")
+    args = parser.parse_args(argv)
+
+    if args.input_file.lower().endswith('.jsonl'):
+        df = pd.read_json(args.input_file, lines=True, dtype=False)
+    elif args.input_file.lower().endswith('.csv'):
+        df = pd.read_csv(args.input_file, dtype=str, keep_default_na=False)
+    else:
+        sys.exit("Error: input file must end in .jsonl or .csv.")
+
+    df = postprocess(df, pivot=args.pivot_phones)
+    if args.output_file.lower().endswith('.csv'):
+        df.to_csv(args.output_file, index=False)
+    else:
+        df.to_excel(args.output_file, index=False)
+    print(f"[INFO] Wrote {len(df)} rows to '{args.output_file}'")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,16 @@
 import os
 import sys
+import time
 import pandas as pd
 import openai
 from google.cloud import vision
 from google.api_core.exceptions import GoogleAPIError
 from tqdm import tqdm
+from confidence import score_rows, CONFIDENCE_THRESHOLD
+from form_layouts import get_layout, extract_with_layout
+from model_router import load_config, choose_models, record_call, estimate_cost
+from postprocess import postprocess
+from scheduler import get_scheduler
 
 # Load OpenAI API key from environment variable
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
@@ -18,26 +24,66 @@ GOOGLE_CREDENTIALS = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
 if not GOOGLE_CREDENTIALS or not os.path.isfile(GOOGLE_CREDENTIALS):
     sys.exit("Error: Google Cloud Vision API credentials not found. Please set the GOOGLE_APPLICATION_CREDENTIALS environment variable to the path of your credentials JSON file.")
 
-def extract_text_from_image(image_path):
+# Raised by process_image when Vision or OpenAI could not be reached or
+# errored, as opposed to a form that simply had no data ([]). The queue worker
+# and the ingest CLI retry these instead of recording the image as done.
+class PipelineError(Exception):
+    pass
+
+def _word_box(bounding_box):
+    xs = [v.x for v in bounding_box.vertices]
+    ys = [v.y for v in bounding_box.vertices]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+# Returns the full OCR result for an image: the text plus every word with its
+# confidence and bounding box, and the page size the boxes are relative to.
+# document_text_detection is used because text_detection leaves the word
+# confidences empty.
+def extract_ocr_from_image(image_path):
+    empty = {'text': '', 'words': [], 'confidence': 0.0, 'width': 0, 'height': 0, 'error': None}
     client = vision.ImageAnnotatorClient()
     try:
         with open(image_path, 'rb') as image_file:
             content = image_file.read()
         image = vision.Image(content=content)
-        response = client.text_detection(image=image)
+        response = client.document_text_detection(image=image)
         if response.error.message:
             raise GoogleAPIError(response.error.message)
-        texts = response.text_annotations
-        extracted_text = texts[0].description if texts else ''
-        return extracted_text.strip()
+        annotation = response.full_text_annotation
+        words = []
+        width = height = 0
+        for page in annotation.pages:
+            width, height = max(width, page.width), max(height, page.height)
+            for block in page.blocks:
+                for paragraph in block.paragraphs:
+                    for word in paragraph.words:
+                        words.append({
+                            'text': ''.join(symbol.text for symbol in word.symbols),
+                            'confidence': word.confidence,
+                            'box': _word_box(word.bounding_box)
+                        })
+        confidence = sum(w['confidence'] for w in words) / len(words) if words else 0.0
+        return {
+            'text': annotation.text.strip(),
+            'words': words,
+            'confidence': confidence,
+            'width': width,
+            'height': height,
+            'error': None
+        }
     except GoogleAPIError as e:
         print(f"[ERROR] Google Vision API error: {e.message}")
-        return ''
+        return dict(empty, error=f"Google Vision API error: {e.message}")
     except Exception as e:
         print(f"[ERROR] Unexpected error processing image '{image_path}': {e}")
-        return ''
+        return dict(empty, error=f"Unexpected error processing image: {e}")
+
+def extract_text_from_image(image_path):
+    return extract_ocr_from_image(image_path)['text']
 
-def process_text_with_gpt(text):
+# Returns the model's reply together with its token usage, which the router
+# needs to price the call, and the error if the API call itself failed.
+def _gpt_completion(text, model):
     prompt = f"""
 Process the following text extracted from a dental form and format it into structured data:
 
@@ -45,7 +91,7 @@ Process the following text extracted from a dental form and format it into struc
 """
     try:
         response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
+            model=model,
             messages=[
                 {"role": "system", "content": "You are an AI that extracts and formats data from dental records."},
                 {"role": "user", "content": prompt}
@@ -53,13 +99,16 @@ Process the following text extracted from a dental form and format it into struc
             max_tokens=1000,
             temperature=0
         )
-        return response['choices'][0]['message']['content'].strip()
+        return response['choices'][0]['message']['content'].strip(), dict(response.get('usage') or {}), None
     except openai.OpenAIError as e:
         print(f"[ERROR] OpenAI API error: {e}")
-        return ''
+        return '', {}, f"OpenAI API error: {e}"
     except Exception as e:
         print(f"[ERROR] Unexpected error processing text with GPT: {e}")
-        return ''
+        return '', {}, f"Unexpected error processing text with GPT: {e}"
+
+def process_text_with_gpt(text, model=None):
+    return _gpt_completion(text, model or load_config()['tiers'][0])[0]
 
 def parse_gpt_output(gpt_output):
     try:
@@ -81,37 +130,128 @@ def parse_gpt_output(gpt_output):
         print(f"[ERROR] Error parsing GPT output: {e}")
         return []
 
-def save_to_excel(data, file_path):
+# Set PIVOT_PHONES=1 to export one row per patient with the phones in
+# separate columns instead of one row per phone.
+PIVOT_PHONES = os.getenv('PIVOT_PHONES', '') not in ('', '0', 'false')
+
+def save_to_excel(data, file_path, pivot_phones=PIVOT_PHONES):
     try:
-        df = pd.DataFrame(data)
-        df.to_excel(file_path, index=False)
-        print(f"[INFO] Excel file saved at '{file_path}'")
+        df = postprocess(pd.DataFrame(data), pivot=pivot_phones)
+        # The writer follows the extension; the upload form offers csv and json
+        # as well as xlsx.
+        extension = os.path.splitext(file_path)[1].lower()
+        if extension == '.csv':
+            df.to_csv(file_path, index=False)
+        elif extension == '.json':
+            df.to_json(file_path, orient='records', force_ascii=False, indent=2)
+        else:
+            df.to_excel(file_path, index=False)
+        print(f"[INFO] Export saved at '{file_path}'")
     except Exception as e:
-        print(f"[ERROR] Error saving Excel file: {e}")
+        print(f"[ERROR] Error saving export file: {e}")
+
+def _valid_rows(rows):
+    return bool(rows) and all(
+        row['Name'] and sum(c.isdigit() for c in row['Phone']) >= 8
+        for row in rows
+    )
+
+def _run_gpt(ocr, model, bucket, image_path):
+    started = time.monotonic()
+    gpt_output, usage, error = _gpt_completion(ocr['text'], model)
+    if error:
+        # An outage says nothing about how well the model reads forms, so it
+        # is not recorded against its success rate.
+        return [], 0.0, False, error
+    parsed_data = parse_gpt_output(gpt_output) if gpt_output else []
+    valid = _valid_rows(parsed_data)
+    record_call(model, bucket, time.monotonic() - started, estimate_cost(model, usage), valid)
+    if not valid:
+        print(f"[WARNING] No valid data parsed from {model} output for '{image_path}'")
+        return [], 0.0, False, None
+    return parsed_data, score_rows(parsed_data, ocr), True, None
 
-def process_uploaded_files(upload_dir, custom_prompt, output_file):
-    image_files = [
+# Runs the OCR -> GPT -> parse pipeline for a single image. This is the unit of
+# work shared by the web upload, the queue worker and the ingest CLI.
+# When the form's layout is known, fields are first read straight from the
+# word boxes and GPT is skipped entirely if that yields valid rows with
+# confidence.
+# Otherwise the router lists the models to try, cheapest first. The next tier
+# is only tried when the output could not be parsed or validated, or when the
+# OCR was good but the fields still score below CONFIDENCE_THRESHOLD (the model
+# misread the form; a poor scan is not retried since a better model cannot fix
+# it). Whatever is still below the threshold is flagged for human review.
+# Raises PipelineError when OCR failed, or when no model produced valid rows
+# and at least one of them errored (the form might have been read had it not).
+def process_image(image_path, layout=None, model=None):
+    ocr = extract_ocr_from_image(image_path)
+    if ocr['error']:
+        raise PipelineError(ocr['error'])
+    if not ocr['text']:
+        return []
+    form_layout = get_layout(layout) if layout else None
+    if form_layout:
+        layout_data, layout_confidence = extract_with_layout(ocr, form_layout)
+        # The label is found with confidence even when the value is "não tem",
+        # so the rows must pass the same check as GPT output.
+        if _valid_rows(layout_data) and layout_confidence >= CONFIDENCE_THRESHOLD:
+            for row in layout_data:
+                row['Needs Review'] = False
+            return layout_data
+        if layout_data:
+            print(f"[INFO] Layout '{layout}' could not read '{image_path}' reliably, falling back to GPT")
+
+    models, bucket = choose_models(ocr['text'], ocr['confidence'], model)
+    parsed_data, confidence = [], 0.0
+    errors = []
+    for candidate in models:
+        candidate_data, candidate_confidence, valid, error = _run_gpt(ocr, candidate, bucket, image_path)
+        if error:
+            errors.append(error)
+        if valid and (candidate_confidence > confidence or not parsed_data):
+            parsed_data, confidence = candidate_data, candidate_confidence
+        if valid and (confidence >= CONFIDENCE_THRESHOLD or ocr['confidence'] < CONFIDENCE_THRESHOLD):
+            break
+        if candidate != models[-1]:
+            print(f"[INFO] Escalating '{image_path}' from {candidate} (confidence {confidence:.2f})")
+    if not parsed_data and errors:
+        raise PipelineError('; '.join(errors))
+    for row in parsed_data:
+        row['Needs Review'] = confidence < CONFIDENCE_THRESHOLD
+    return parsed_data
+
+def list_image_files(upload_dir):
+    return [
         os.path.join(upload_dir, f)
         for f in os.listdir(upload_dir)
         if f.lower().endswith((".jpg", ".png", ".jpeg", ".tiff"))
     ]
+
+# The web upload has no retry path, so a failed image is reported and skipped
+# like before instead of failing the whole upload.
+def _process_image_or_skip(image_path, layout=None, model=None):
+    try:
+        return process_image(image_path, layout, model)
+    except PipelineError as e:
+        print(f"[ERROR] Skipping '{image_path}': {e}")
+        return []
+
+# With a user_id the images are run on the shared fair-share scheduler, so a
+# large upload cannot hold up other users' small ones.
+def process_uploaded_files(upload_dir, custom_prompt, output_file, layout=None, model=None, user_id=None):
+    image_files = list_image_files(upload_dir)
     if not image_files:
         print(f"[ERROR] No image files found in '{upload_dir}'.")
         return None
     
     all_data = []
-    for image_path in tqdm(image_files, desc="Processing images"):
-        extracted_text = extract_text_from_image(image_path)
-        if not extracted_text:
-            continue
-        gpt_output = process_text_with_gpt(extracted_text)
-        if not gpt_output:
-            continue
-        parsed_data = parse_gpt_output(gpt_output)
-        if not parsed_data:
-            print(f"[WARNING] No valid data parsed from GPT output for '{image_path}'")
-            continue
-        all_data.extend(parsed_data)
+    if user_id is not None:
+        results = get_scheduler().map(user_id, lambda path: _process_image_or_skip(path, layout, model), image_files)
+        for parsed_data in results:
+            all_data.extend(parsed_data)
+    else:
+        for image_path in tqdm(image_files, desc="Processing images"):
+            all_data.extend(_process_image_or_skip(image_path, layout, model))
     
     if all_data:
         save_to_excel(all_data, output_file)
@@ -0,0 +1,184 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+# Fair-share scheduling of image-level work across concurrent uploads. Every
+# upload is split into one task per image and queued under the uploading user.
+# A fixed pool of threads always takes the next task from the user with the
+# lowest "pass" (stride scheduling): each dispatched task advances the user's
+# pass by 1 / weight, so users get worker time in proportion to their weight
+# regardless of how many images they queued. A 3-form upload therefore waits
+# behind at most one image of a 500-form backfill, while the backfill still
+# gets every worker nobody else is using.
+#
+#   SCHEDULER_WORKERS   size of the thread pool (default 8)
+#   SCHEDULER_USER_CAP  max images one user may have in flight while other
+#                       users have work queued (default workers - 1). A user
+#                       with no competition may go over it and use the whole
+#                       pool.
+#   SCHEDULER_WEIGHTS   per-user weights > 0, e.g. "3:2,7:0.5" (default 1)
+
+def _parse_weights(value):
+    weights = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        user_id, weight = item.split(':')
+        if float(weight) <= 0:
+            # A user's pass advances by 1 / weight, which needs a positive weight.
+            print(f"[WARNING] Ignoring SCHEDULER_WEIGHTS entry '{item}': the weight must be positive")
+            continue
+        weights[int(user_id)] = float(weight)
+    return weights
+
+class _Task:
+    __slots__ = ('func', 'args', 'future', 'enqueued_at')
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+class _UserState:
+    def __init__(self):
+        self.queue = deque()
+        self.running = 0
+        self.pass_value = 0.0
+        self.completed = 0
+        self.failed = 0
+        self.dispatched = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+
+class FairScheduler:
+    def __init__(self, workers=8, user_cap=None, weights=None):
+        self.workers = workers
+        self.user_cap = user_cap or max(1, workers - 1)
+        self.weights = weights or {}
+        self.users = {}
+        self.virtual_time = 0.0
+        self.busy = 0
+        self.condition = threading.Condition()
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"scheduler-{i}", daemon=True).start()
+
+    def submit(self, user_id, func, *args):
+        task = _Task(func, args)
+        with self.condition:
+            user = self.users.get(user_id)
+            if user is None:
+                user = self.users[user_id] = _UserState()
+            if not user.queue and not user.running:
+                # A user who was idle rejoins at the current virtual time, so
+                # being idle does not build up credit to starve others later.
+                user.pass_value = max(user.pass_value, self.virtual_time)
+            user.queue.append(task)
+            self.condition.notify()
+        return task.future
+
+    def map(self, user_id, func, items):
+        # Runs func over items under user_id's share and returns the results
+        # in order. Blocks the calling request thread until all are done.
+        futures = [self.submit(user_id, func, item) for item in items]
+        return [future.result() for future in futures]
+
+    def _next_task(self):
+        with self.condition:
+            while True:
+                best_id, best = None, None
+                waiting = [(user_id, user) for user_id, user in self.users.items() if user.queue]
+                for user_id, user in waiting:
+                    if user.running < self.user_cap:
+                        if best is None or user.pass_value < best.pass_value:
+                            best_id, best = user_id, user
+                if best is None and len(waiting) == 1:
+                    # Nobody else is waiting, so the cap would only leave a
+                    # worker idle. A newcomer waits at most one image for it.
+                    best_id, best = waiting[0]
+                if best is not None:
+                    break
+                self.condition.wait()
+            task = best.queue.popleft()
+            try:
+                stride = 1.0 / self.weights.get(best_id, 1.0)
+                wait = time.monotonic() - task.enqueued_at
+            except Exception as e:
+                # The task is already off the queue, so fail it rather than
+                # leave its request waiting on the future forever.
+                if task.future.set_running_or_notify_cancel():
+                    task.future.set_exception(e)
+                best.failed += 1
+                raise
+            self.virtual_time = best.pass_value
+            best.pass_value += stride
+            best.running += 1
+            self.busy += 1
+            best.dispatched += 1
+            best.total_wait += wait
+            best.max_wait = max(best.max_wait, wait)
+            best.last_wait = wait
+            return best, task
+
+    def _work(self):
+        while True:
+            try:
+                user, task = self._next_task()
+            except Exception as e:
+                # A pool thread that dies takes a worker with it for good.
+                print(f"[ERROR] Scheduler failed to dispatch a task: {e}")
+                continue
+            failed = False
+            if task.future.set_running_or_notify_cancel():
+                try:
+                    task.future.set_result(task.func(*task.args))
+                except BaseException as e:
+                    failed = True
+                    task.future.set_exception(e)
+            with self.condition:
+                user.running -= 1
+                self.busy -= 1
+                if failed:
+                    user.failed += 1
+                else:
+                    user.completed += 1
+                # A slot under this user's cap opened up.
+                self.condition.notify_all()
+
+    def metrics(self, user_id=None):
+        # With a user_id only that user's entry is included.
+        with self.condition:
+            return {
+                'workers': self.workers,
+                'busy_workers': self.busy,
+                'user_cap': self.user_cap,
+                'users': {
+                    str(uid): {
+                        'weight': self.weights.get(uid, 1.0),
+                        'queued': len(user.queue),
+                        'running': user.running,
+                        'completed': user.completed,
+                        'failed': user.failed,
+                        'oldest_queued_seconds': round(time.monotonic() - user.queue[0].enqueued_at, 3) if user.queue else 0.0,
+                        'avg_wait_seconds': round(user.total_wait / user.dispatched, 3) if user.dispatched else 0.0,
+                        'max_wait_seconds': round(user.max_wait, 3),
+                        'last_wait_seconds': round(user.last_wait, 3)
+                    }
+                    for uid, user in self.users.items()
+                    if user_id is None or uid == user_id
+                }
+            }
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            workers = int(os.getenv('SCHEDULER_WORKERS', '8'))
+            user_cap = int(os.getenv('SCHEDULER_USER_CAP', '0')) or None
+            weights = _parse_weights(os.getenv('SCHEDULER_WEIGHTS', ''))
+            _scheduler = FairScheduler(workers, user_cap, weights)
+        return _scheduler
@@ -13,6 +13,7 @@ $(document).ready(function() {
         formData.append('file', fileInput[0]);
         formData.append('custom_prompt', $('#custom_prompt').val());
         formData.append('model', $('#model').val());
+        formData.append('layout', $('#layout').val() || '');
         formData.append('format', $('#format').val());
 
         $('#progress-container').show();
@@ -31,7 +32,7 @@ $(document).ready(function() {
                 return xhr;
             },
             type: 'POST',
-            url: '/',
+            url: '/upload',
             data: formData,
             contentType: false,
             processData: false,
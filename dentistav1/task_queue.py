@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import sqlite3
+
+# Shared image-level task queue. Tasks are handed out under a lease that the
+# worker keeps alive with heartbeats. A task whose lease expires goes back to
+# the pool, so each image is processed at least once even if a worker dies
+# mid-task.
+#
+# QUEUE_DATABASE is either a SQLite file or a postgresql:// URL (needs
+# psycopg2). SQLite relies on WAL shared memory and file locks that do not
+# work over NFS/SMB, so a SQLite queue only serves workers on the host that
+# has the file on local disk. Workers on several machines need Postgres, where
+# tasks are claimed with SELECT ... FOR UPDATE SKIP LOCKED.
+#
+# Tasks store the image path as given at enqueue time, so every worker must
+# see the images under that same path (e.g. one shared mount everywhere).
+QUEUE_DATABASE = os.getenv('QUEUE_DATABASE', 'queue.db')
+LEASE_SECONDS = int(os.getenv('QUEUE_LEASE_SECONDS', '120'))
+MAX_ATTEMPTS = int(os.getenv('QUEUE_MAX_ATTEMPTS', '3'))
+
+class _PostgresConnection:
+    # Gives a psycopg2 connection the conn.execute() shape of sqlite3 so the
+    # queue functions below serve both backends.
+    def __init__(self, url):
+        import psycopg2
+        self.conn = psycopg2.connect(url)
+        self.conn.autocommit = True
+
+    def execute(self, sql, params=()):
+        cur = self.conn.cursor()
+        cur.execute(sql.replace('?', '%s'), params)
+        return cur
+
+    def executemany(self, sql, params):
+        cur = self.conn.cursor()
+        cur.executemany(sql.replace('?', '%s'), params)
+        return cur
+
+    def close(self):
+        self.conn.close()
+
+def _is_postgres(conn):
+    return isinstance(conn, _PostgresConnection)
+
+def connect_queue(path=None):
+    path = path or QUEUE_DATABASE
+    if path.startswith(('postgres://', 'postgresql://')):
+        conn = _PostgresConnection(path)
+    else:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA busy_timeout=30000')
+    init_queue(conn)
+    return conn
+
+def _begin(conn):
+    # BEGIN IMMEDIATE takes SQLite's write lock up front; Postgres locks rows.
+    conn.execute('BEGIN' if _is_postgres(conn) else 'BEGIN IMMEDIATE')
+
+def init_queue(conn):
+    if _is_postgres(conn):
+        for statement in (
+            '''CREATE TABLE IF NOT EXISTS tasks (
+                id BIGSERIAL PRIMARY KEY,
+                batch_id TEXT NOT NULL,
+                image_path TEXT NOT NULL,
+                layout TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker_id TEXT,
+                lease_expires_at DOUBLE PRECISION,
+                result TEXT,
+                error TEXT,
+                created_at DOUBLE PRECISION NOT NULL,
+                updated_at DOUBLE PRECISION NOT NULL
+            )''',
+            'ALTER TABLE tasks ADD COLUMN IF NOT EXISTS layout TEXT',
+            'CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, lease_expires_at)',
+            'CREATE INDEX IF NOT EXISTS idx_tasks_batch ON tasks (batch_id, status)'
+        ):
+            conn.execute(statement)
+        return
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY,
+            batch_id TEXT NOT NULL,
+            image_path TEXT NOT NULL,
+            layout TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker_id TEXT,
+            lease_expires_at REAL,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, lease_expires_at);
+        CREATE INDEX IF NOT EXISTS idx_tasks_batch ON tasks (batch_id, status);
+    ''')
+    # Queues created before per-task layouts existed lack the column.
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(tasks)')}
+    if 'layout' not in columns:
+        try:
+            conn.execute('ALTER TABLE tasks ADD COLUMN layout TEXT')
+        except sqlite3.OperationalError as e:
+            # Another worker starting at the same time added it first.
+            if 'duplicate column name' not in str(e):
+                raise
+
+def enqueue(conn, batch_id, image_paths, layout=None):
+    now = time.time()
+    _begin(conn)
+    try:
+        conn.executemany(
+            'INSERT INTO tasks (batch_id, image_path, layout, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+            [(batch_id, path, layout, now, now) for path in image_paths]
+        )
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return len(image_paths)
+
+def lease_task(conn, worker_id, lease_seconds=LEASE_SECONDS):
+    now = time.time()
+    # The row is selected and claimed in one transaction, under SQLite's write
+    # lock or a Postgres row lock, so two workers can never claim the same row.
+    # SKIP LOCKED lets other Postgres workers claim the next row meanwhile.
+    _begin(conn)
+    try:
+        row = conn.execute('''
+            SELECT id, batch_id, image_path, layout, attempts FROM tasks
+            WHERE (status = 'pending' OR (status = 'leased' AND lease_expires_at < ?))
+              AND attempts < ?
+            ORDER BY id
+            LIMIT 1
+        ''' + (' FOR UPDATE SKIP LOCKED' if _is_postgres(conn) else ''), (now, MAX_ATTEMPTS)).fetchone()
+        if row is None:
+            conn.execute('COMMIT')
+            return None
+        conn.execute('''
+            UPDATE tasks
+            SET status = 'leased', worker_id = ?, lease_expires_at = ?, attempts = attempts + 1, updated_at = ?
+            WHERE id = ?
+        ''', (worker_id, now + lease_seconds, now, row[0]))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return {'id': row[0], 'batch_id': row[1], 'image_path': row[2], 'layout': row[3], 'attempts': row[4] + 1}
+
+def heartbeat(conn, task_id, worker_id, lease_seconds=LEASE_SECONDS):
+    now = time.time()
+    cur = conn.execute('''
+        UPDATE tasks SET lease_expires_at = ?, updated_at = ?
+        WHERE id = ? AND worker_id = ? AND status = 'leased'
+    ''', (now + lease_seconds, now, task_id, worker_id))
+    return cur.rowcount == 1
+
+def complete_task(conn, task_id, worker_id, result):
+    cur = conn.execute('''
+        UPDATE tasks SET status = 'done', result = ?, error = NULL, lease_expires_at = NULL, updated_at = ?
+        WHERE id = ? AND worker_id = ? AND status = 'leased'
+    ''', (json.dumps(result, ensure_ascii=False), time.time(), task_id, worker_id))
+    return cur.rowcount == 1
+
+def fail_task(conn, task_id, worker_id, error):
+    cur = conn.execute('''
+        UPDATE tasks
+        SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+            error = ?, worker_id = NULL, lease_expires_at = NULL, updated_at = ?
+        WHERE id = ? AND worker_id = ? AND status = 'leased'
+    ''', (MAX_ATTEMPTS, str(error), time.time(), task_id, worker_id))
+    return cur.rowcount == 1
+
+def reap_expired(conn):
+    # Leases that ran out on the last allowed attempt would otherwise stay
+    # 'leased' forever, since lease_task no longer picks them up.
+    cur = conn.execute('''
+        UPDATE tasks SET status = 'failed', error = 'lease expired', updated_at = ?
+        WHERE status = 'leased' AND lease_expires_at < ? AND attempts >= ?
+    ''', (time.time(), time.time(), MAX_ATTEMPTS))
+    return cur.rowcount
+
+def batch_status(conn, batch_id):
+    rows = conn.execute(
+        'SELECT status, COUNT(*) FROM tasks WHERE batch_id = ? GROUP BY status', (batch_id,)
+    ).fetchall()
+    return dict(rows)
+
+def batch_results(conn, batch_id):
+    rows = conn.execute(
+        "SELECT result FROM tasks WHERE batch_id = ? AND status = 'done' ORDER BY id", (batch_id,)
+    )
+    for (result,) in rows:
+        yield from json.loads(result)
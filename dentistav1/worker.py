@@ -0,0 +1,137 @@
+import os
+import sys
+import time
+import uuid
+import socket
+import argparse
+import threading
+
+from task_queue import (
+    connect_queue, enqueue, lease_task, heartbeat, complete_task, fail_task,
+    reap_expired, batch_status, batch_results, LEASE_SECONDS
+)
+from form_layouts import load_layouts
+
+# Standalone worker for the digitization pipeline. Run as many of these as
+# needed against the shared queue (see task_queue.py: a SQLite queue serves one
+# host, a Postgres queue any number of machines). Images are queued by absolute
+# path, so every worker machine must mount them under the same path:
+#
+#   python worker.py enqueue uploads/<batch_dir> --batch-id <id>
+#   python worker.py run
+#   python worker.py status <id>
+#   python worker.py export <id> processed/<id>.xlsx
+
+POLL_INTERVAL = float(os.getenv('QUEUE_POLL_INTERVAL', '2'))
+
+class Heartbeat(threading.Thread):
+    # Keeps the lease of the current task alive while the pipeline runs. Uses
+    # its own connection because sqlite3 connections are bound to one thread.
+    def __init__(self, task_id, worker_id, lease_seconds):
+        super().__init__(daemon=True)
+        self.task_id = task_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+
+    def run(self):
+        conn = connect_queue()
+        try:
+            while not self.stopped.wait(self.lease_seconds / 3):
+                if not heartbeat(conn, self.task_id, self.worker_id, self.lease_seconds):
+                    # complete_task and fail_task check the lease too, so the
+                    # result of a task another worker took over is dropped there.
+                    print(f"[WARNING] Lost lease on task {self.task_id}")
+                    return
+        finally:
+            conn.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def run_worker(worker_id, lease_seconds=LEASE_SECONDS, poll_interval=POLL_INTERVAL, once=False):
+    from py import process_image
+
+    conn = connect_queue()
+    print(f"[INFO] Worker '{worker_id}' started")
+    while True:
+        reap_expired(conn)
+        task = lease_task(conn, worker_id, lease_seconds)
+        if task is None:
+            if once:
+                break
+            time.sleep(poll_interval)
+            continue
+
+        beat = Heartbeat(task['id'], worker_id, lease_seconds)
+        beat.start()
+        try:
+            rows = process_image(task['image_path'], task['layout'])
+        except Exception as e:
+            # PipelineError (Vision/OpenAI outage, rate limit) ends up here too,
+            # so the image is retried up to QUEUE_MAX_ATTEMPTS instead of being
+            # recorded as a form without data.
+            beat.stop()
+            print(f"[ERROR] Task {task['id']} failed on attempt {task['attempts']}: {e}")
+            fail_task(conn, task['id'], worker_id, e)
+            continue
+        beat.stop()
+
+        if not complete_task(conn, task['id'], worker_id, rows):
+            # Another worker picked the task up after our lease expired; its
+            # result wins and ours is discarded.
+            print(f"[WARNING] Task {task['id']} was re-leased before completion, result discarded")
+    conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Distributed worker for dental form digitization.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_enqueue = sub.add_parser('enqueue', help="Queue every image in a directory.")
+    p_enqueue.add_argument('directory')
+    p_enqueue.add_argument('--batch-id', default=None)
+    p_enqueue.add_argument('--layout', default=None, help="Form layout from form_layouts.json used for this batch.")
+
+    p_run = sub.add_parser('run', help="Process tasks from the queue.")
+    p_run.add_argument('--worker-id', default=f"{socket.gethostname()}-{os.getpid()}")
+    p_run.add_argument('--lease-seconds', type=int, default=LEASE_SECONDS)
+    p_run.add_argument('--poll-interval', type=float, default=POLL_INTERVAL)
+    p_run.add_argument('--once', action='store_true', help="Exit when the queue is empty.")
+
+    p_status = sub.add_parser('status', help="Show task counts for a batch.")
+    p_status.add_argument('batch_id')
+
+    p_export = sub.add_parser('export', help="Write the rows of a finished batch to a file.")
+    p_export.add_argument('batch_id')
+    p_export.add_argument('output_file')
+    p_export.add_argument('--pivot-phones', action='store_true', help="One row per patient with the phones in separate columns.")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'enqueue':
+        if not os.path.isdir(args.directory):
+            sys.exit(f"Error: '{args.directory}' is not a directory.")
+        if args.layout and args.layout not in load_layouts():
+            sys.exit(f"Error: unknown form layout '{args.layout}'. Known layouts: {', '.join(sorted(load_layouts())) or 'none'}.")
+        from py import list_image_files
+        batch_id = args.batch_id or uuid.uuid4().hex
+        conn = connect_queue()
+        count = enqueue(conn, batch_id, [os.path.abspath(p) for p in list_image_files(args.directory)], args.layout)
+        print(f"[INFO] Queued {count} images in batch '{batch_id}'")
+    elif args.command == 'run':
+        run_worker(args.worker_id, args.lease_seconds, args.poll_interval, args.once)
+    elif args.command == 'status':
+        conn = connect_queue()
+        for status, count in sorted(batch_status(conn, args.batch_id).items()):
+            print(f"{status}: {count}")
+    elif args.command == 'export':
+        from py import save_to_excel
+        conn = connect_queue()
+        rows = list(batch_results(conn, args.batch_id))
+        if not rows:
+            sys.exit(f"Error: no finished rows for batch '{args.batch_id}'.")
+        save_to_excel(rows, args.output_file, pivot_phones=args.pivot_phones)
+
+if __name__ == "__main__":
+    main()